@@ -1,23 +1,45 @@
-# bot.py — адаптовано спеціально під Railway.app (без FFmpeg)
+# bot.py — адаптовано спеціально під Railway.app (FFmpeg не обов'язковий)
 import asyncio
+import http.cookiejar
 import logging
 import os
 import re
-import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
 from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
 from aiogram.types import FSInputFile, Message
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
+from yt_dlp.postprocessor import FFmpegExtractAudioPP, FFmpegPostProcessor
+
+try:
+    import uvloop  # швидший event loop; недоступний на Windows
+except ImportError:
+    uvloop = None
 
 # ────────────────────────────────────────────────
 # Глобальна змінна для username бота
@@ -34,13 +56,40 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не знайдено в .env")
 
-DOWNLOAD_DIR = Path("downloads")
-DOWNLOAD_DIR.mkdir(exist_ok=True)
+# Якщо REDIS_URL не задано — стани зберігаються в пам'яті процесу
+REDIS_URL = os.getenv("REDIS_URL")
 
 MAX_FILE_SIZE_MB = 48
-SEARCH_LIMIT = 3
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # FSInputFile читає файл через aiofiles такими шматками
+SEARCH_LIMIT = 1  # використовується лише перший результат
 MAX_PLAYLIST_ITEMS = 1
 REQUEST_MAX_LENGTH = 100
+FSM_TTL_SECONDS = 300
+COOKIES_FILE = "cookies.txt"
+TELEGRAM_RATE_LIMIT = 28  # запитів за секунду, трохи нижче ліміту Telegram (30)
+
+# Регулярні вирази компілюються один раз при імпорті
+_FN_BAD = re.compile(r'[<>:"/\\|?*]')
+_WS_RE = re.compile(r"\s+")
+
+# ID відео YouTube та посилання youtube.com / youtu.be
+YT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+YT_LINK_RE = re.compile(
+    r"^https?://(?:www\.|m\.|music\.)?"
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/)|youtu\.be/)"
+    r"([A-Za-z0-9_-]{11})(?:[?&#/]|$)"
+)
+DOWNLOAD_QUEUE_SIZE = 32
+DOWNLOAD_WORKERS = 8  # мережа: пошук і завантаження з YouTube
+UPLOAD_WORKERS = 8  # мережа: надсилання в Telegram
+ENCODE_SLOTS = os.cpu_count() or 1  # CPU: одночасні перекодування
+
+# Кеш: нормалізований запит → file_id вже надісланого аудіо
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+# Якість перекодування за шкалою yt-dlp (0 — найкраща, 10 — найгірша);
+# для libfdk_aac це -vbr 4 ≈ 128 kbps стерео — достатньо для Telegram
+ENCODE_QUALITY = 2
 
 logging.basicConfig(
     level=logging.INFO,
@@ -49,12 +98,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ────────────────────────────────────────────────
+# Опції yt-dlp
+# ────────────────────────────────────────────────
+
+# Опції для пошуку (з cookies)
+YDL_OPTS_SEARCH = {
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": True,
+    "default_search": "ytsearch",
+    "cookiefile": COOKIES_FILE,  # ← обов’язково для обходу Sign in
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
+    "referer": "https://www.youtube.com/",
+}
+
+# Опції для завантаження (FFmpeg не потрібен — на Railway його немає)
+# Тека задається для кожного запиту через params["paths"]
+YDL_OPTS_DOWNLOAD = {
+    # m4a (AAC) Telegram програє як аудіо без перекодування
+    "format": "bestaudio[ext=m4a]/bestaudio/best",
+    "outtmpl": "%(id)s.%(ext)s",
+    "quiet": True,
+    "continuedl": True,
+    # Паралельні фрагменти для DASH/HLS і великі шматки для цільних файлів
+    "concurrent_fragment_downloads": 8,
+    "http_chunk_size": 10 * 1024 * 1024,
+    "cookiefile": COOKIES_FILE,
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
+    "referer": "https://www.youtube.com/",
+}
+
+YDL_OPTIONS = {
+    "search": YDL_OPTS_SEARCH,
+    "download": YDL_OPTS_DOWNLOAD,
+}
+
+# Екземпляри YoutubeDL живуть у своєму потоці й перевикористовуються між запитами,
+# а з ними і keep-alive пул HTTP-з'єднань до YouTube (requests з yt-dlp[default])
+_ydl_local = threading.local()
+
+# Одна банка cookies на всі екземпляри: читається один раз при імпорті, ще до
+# появи потоків, тож оновлені YouTube cookies одразу бачать усі запити
+COOKIES_JAR = YoutubeDLCookieJar(COOKIES_FILE)
+try:
+    COOKIES_JAR.load()
+except (OSError, http.cookiejar.LoadError) as e:
+    logger.warning(f"Не вдалося прочитати {COOKIES_FILE}: {e}")
+_cookies_lock = threading.Lock()
+
+# ────────────────────────────────────────────────
+# Обмеження частоти запитів до Telegram API
+# ────────────────────────────────────────────────
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    def __init__(self, limiter: AsyncLimiter):
+        self.limiter = limiter
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        # Long polling не рахується до ліміту на надсилання
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        async with self.limiter:
+            return await make_request(bot, method)
+
+GLOBAL_LIMITER = AsyncLimiter(TELEGRAM_RATE_LIMIT, 1)
+
 bot = Bot(
     token=BOT_TOKEN,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
+bot.session.middleware(RateLimitMiddleware(GLOBAL_LIMITER))
 
-storage = MemoryStorage()
+if REDIS_URL:
+    storage = RedisStorage.from_url(
+        REDIS_URL,
+        state_ttl=FSM_TTL_SECONDS,
+        data_ttl=FSM_TTL_SECONDS
+    )
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
@@ -63,10 +191,13 @@ dp.include_router(router)
 # Функція для отримання username бота
 # ────────────────────────────────────────────────
 
+@dp.startup()
 async def load_bot_username():
+    # bot.me() кешує відповідь, тож polling перед першим getUpdates
+    # використає цей самий getMe, а не надішле другий
     global BOT_USERNAME
     try:
-        me = await bot.get_me()
+        me = await bot.me()
         BOT_USERNAME = me.username
         logger.info(f"Бот запущено як @{BOT_USERNAME}")
     except Exception as e:
@@ -85,16 +216,29 @@ class SearchForm(StatesGroup):
 # ────────────────────────────────────────────────
 
 def sanitize_filename(name: str) -> str:
-    return re.sub(r'[<>:"/\\|?*]', '_', name).strip()
-
-def get_user_dir(user_id: int) -> Path:
-    path = DOWNLOAD_DIR / f"user_{user_id}"
-    path.mkdir(exist_ok=True)
-    return path
-
-def clean_user_dir(user_dir: Path):
-    if user_dir.exists():
-        shutil.rmtree(user_dir, ignore_errors=True)
+    return _FN_BAD.sub('_', name).strip()
+
+def normalize_query(query: str) -> str:
+    return _WS_RE.sub(" ", query.lower().strip())
+
+def cache_get(key: str) -> Optional[dict]:
+    track = SEARCH_CACHE.get(key)
+    if track is not None:
+        SEARCH_CACHE.move_to_end(key)
+    return track
+
+def cache_put(key: str, track: dict):
+    SEARCH_CACHE[key] = track
+    SEARCH_CACHE.move_to_end(key)
+    if len(SEARCH_CACHE) > SEARCH_CACHE_SIZE:
+        SEARCH_CACHE.popitem(last=False)
+
+def extract_video_id(text: str) -> Optional[str]:
+    text = text.strip()
+    if YT_ID_RE.match(text):
+        return text
+    match = YT_LINK_RE.match(text)
+    return match.group(1) if match else None
 
 def format_duration(seconds: Optional[float]) -> str:
     if seconds is None:
@@ -105,134 +249,335 @@ def format_duration(seconds: Optional[float]) -> str:
         return f"{h:02d}:{m:02d}:{s:02d}"
     return f"{m:02d}:{s:02d}"
 
-async def download_and_send(
-    message: Message,
-    query: str,
-    state: FSMContext = None
-):
-    user_id = message.from_user.id
-    user_dir = get_user_dir(user_id)
+def build_caption(title: str, uploader: str, duration: Optional[float], query: str) -> str:
+    caption_text = (
+        f"<b>{title}</b>\n"
+        f"Виконавець: {uploader}\n"
+        f"Тривалість: {format_duration(duration)}\n"
+        f"Запит: {query}"
+    )
+    if BOT_USERNAME:
+        caption_text += f"\n@{BOT_USERNAME}"
+    return caption_text
+
+def _get_ydl(kind: str) -> yt_dlp.YoutubeDL:
+    # Створюється один раз на потік — без повторної ініціалізації екстракторів і cookies
+    ydl = getattr(_ydl_local, kind, None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(YDL_OPTIONS[kind])
+        # Замість власної копії з cookies.txt — спільна банка
+        ydl.cookiejar = COOKIES_JAR
+        setattr(_ydl_local, kind, ydl)
+    return ydl
+
+def _save_cookies():
+    # Запис у тимчасовий файл і атомарна заміна: cookies.txt ніколи не буває обрізаним.
+    # Внутрішній замок банки не дає іншим потокам змінювати cookies під час запису
+    tmp_path = f"{COOKIES_FILE}.tmp"
+    with _cookies_lock:
+        with COOKIES_JAR._cookies_lock:
+            COOKIES_JAR.save(tmp_path)
+        os.replace(tmp_path, COOKIES_FILE)
+
+@contextmanager
+def _using_ydl(kind: str):
+    # Як колись `with YoutubeDL(...)`: після запиту оновлені YouTube cookies
+    # записуються назад у cookies.txt, хоча сам екземпляр не закривається
+    ydl = _get_ydl(kind)
+    try:
+        yield ydl
+    finally:
+        _save_cookies()
+
+def _run_search(query: str) -> dict:
+    # Блокуючий виклик — запускається в DOWNLOAD_EXECUTOR
+    with _using_ydl("search") as ydl:
+        return ydl.extract_info(f"ytsearch{SEARCH_LIMIT}:{query}", download=False)
+
+def _run_lookup(url: str) -> dict:
+    # Повна екстракція одного відео без пошуку; формат обирає вже _run_download
+    with _using_ydl("search") as ydl:
+        return ydl.extract_info(url, download=False, process=False)
+
+def _run_download(url: str, target_dir: Path, entry: Optional[dict] = None) -> dict:
+    # Блокуючий виклик — запускається в DOWNLOAD_EXECUTOR
+    with _using_ydl("download") as ydl:
+        ydl.params["paths"] = {"home": str(target_dir)}
+        if entry is not None:
+            # Відео вже витягнуто в _run_lookup — лише вибір формату й завантаження
+            return ydl.process_ie_result(entry, download=True)
+        return ydl.extract_info(url, download=True)
+
+def _run_encode(info: dict) -> dict:
+    # Перекодування в m4a — CPU-етап, окремо від завантаження.
+    # Лише якщо FFmpeg зібрано з libfdk_aac: yt-dlp сам обере цей енкодер
+    # і передасть -vbr за ENCODE_QUALITY; без нього файл лишається як є
+    ydl = _get_ydl("download")
+    _, features = FFmpegPostProcessor.get_versions_and_features(ydl)
+    if not features.get("fdk"):
+        return info
+    pp = FFmpegExtractAudioPP(ydl, preferredcodec="m4a", preferredquality=ENCODE_QUALITY)
+    _, info = pp.run(info)
+    return info
+
+# ────────────────────────────────────────────────
+# Конвеєр завантаження: пошук/завантаження → перекодування/надсилання
+# Кожен ресурс має свій ліміт: потоки для YouTube, слоти CPU, воркери надсилання
+# ────────────────────────────────────────────────
 
+@dataclass
+class DownloadJob:
+    message: Message
+    query: str
+    cache_key: str
+    video_id: Optional[str]
+    status_msg: Optional[Message] = None
+    tmp_dir: Optional[tempfile.TemporaryDirectory] = None
+    info: Optional[dict] = None
+    title: str = "Unknown title"
+    uploader: str = "Unknown artist"
+    duration: Optional[float] = None
+    thumbnail: Optional[str] = None
+
+DOWNLOAD_Q: "asyncio.Queue[DownloadJob]" = asyncio.Queue(DOWNLOAD_QUEUE_SIZE)
+UPLOAD_Q: "asyncio.Queue[DownloadJob]" = asyncio.Queue(DOWNLOAD_QUEUE_SIZE)
+worker_tasks = []
+downloaders_busy = 0
+
+# Власні пули потоків замість спільного для asyncio.to_thread (min(32, cpu + 4)):
+# DOWNLOAD_WORKERS справді виконуються паралельно, а перекодування не займає їхні потоки
+DOWNLOAD_EXECUTOR = ThreadPoolExecutor(DOWNLOAD_WORKERS, thread_name_prefix="ytdlp")
+ENCODE_EXECUTOR = ThreadPoolExecutor(ENCODE_SLOTS, thread_name_prefix="encode")
+ENCODE_SEMAPHORE = asyncio.Semaphore(ENCODE_SLOTS)
+
+async def run_blocking(executor: ThreadPoolExecutor, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+async def notify(job: DownloadJob, text: str):
+    # Статусного повідомлення ще може не бути (пошук не завершено, черги не було) — тоді відповідаємо новим
+    if job.status_msg:
+        await job.status_msg.edit_text(text)
+    else:
+        await job.message.answer(text)
+
+async def report_error(job: DownloadJob, e: Exception):
+    logger.exception("Критична помилка")
+    error_text = f"Сталася помилка: {str(e)[:200]}..."
     try:
-        status_msg = await message.answer("🔍 Шукаю...")
-
-        # Опції для пошуку (з cookies)
-        ydl_opts_search = {
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": True,
-            "default_search": "ytsearch",
-            "cookiefile": "cookies.txt",  # ← обов’язково для обходу Sign in
-            "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
-            "referer": "https://www.youtube.com/",
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts_search) as ydl:
-            try:
-                search_result = ydl.extract_info(f"ytsearch{SEARCH_LIMIT}:{query}", download=False)
-                logger.info("Пошук пройшов успішно (cookies підхоплено)")
-            except Exception as e:
-                logger.exception("Помилка пошуку")
-                await status_msg.edit_text("Не вдалося знайти трек 😔\nСпробуйте інший запит або оновіть cookies.txt.")
-                return
+        await notify(job, error_text)
+    except Exception:
+        try:
+            await job.message.answer(error_text)
+        except Exception as send_error:
+            # Напр., користувач заблокував бота — воркер не повинен через це зупинитися
+            logger.warning(f"Не вдалося повідомити про помилку: {send_error}")
+
+async def send_cached(message: Message, query: str, cache_key: str) -> bool:
+    cached = cache_get(cache_key)
+    if not cached:
+        return False
+    try:
+        await message.answer_audio(
+            audio=cached["file_id"],
+            title=cached["title"],
+            performer=cached["uploader"],
+            duration=int(cached["duration"]) if cached["duration"] else None,
+            caption=build_caption(cached["title"], cached["uploader"], cached["duration"], query)
+        )
+        logger.info(f"Відповідь з кешу: {cache_key}")
+        return True
+    except TelegramBadRequest:
+        logger.warning(f"file_id з кешу недійсний, завантажую заново: {cache_key}")
+        SEARCH_CACHE.pop(cache_key, None)
+        return False
+
+async def fetch_track(job: DownloadJob) -> bool:
+    """Пошук і завантаження. Повертає True, якщо файл готовий до надсилання."""
+    entry = None
+    resolved = None  # результат _run_lookup, який не треба витягувати вдруге
+    if job.video_id:
+        # Запит уже є ID/посиланням — пошук не потрібен
+        url = f"https://youtu.be/{job.video_id}"
+        try:
+            entry = resolved = await run_blocking(DOWNLOAD_EXECUTOR, _run_lookup, url)
+        except Exception as e:
+            if not YT_ID_RE.match(job.query):
+                # Посилання на недоступне відео (приватне, 18+, потребує входу) —
+                # шукати URL як текст означало б надіслати випадковий трек
+                logger.warning(f"Не вдалося отримати відео {job.video_id}: {e}")
+                await notify(job, "Не вдалося отримати це відео 😔\nМожливо, воно приватне або має обмеження.")
+                return False
+            logger.warning(f"Не вдалося отримати відео {job.video_id}, шукаю як текст")
+            # Це був не ID, а звичайний текст з 11 символів — кешуємо як текстовий запит
+            job.cache_key = normalize_query(job.query)
+
+    if entry is None:
+        try:
+            search_result = await run_blocking(DOWNLOAD_EXECUTOR, _run_search, job.query)
+            logger.info("Пошук пройшов успішно (cookies підхоплено)")
+        except Exception as e:
+            logger.exception("Помилка пошуку")
+            await notify(job, "Не вдалося знайти трек 😔\nСпробуйте інший запит або оновіть cookies.txt.")
+            return False
 
         if "entries" not in search_result or not search_result["entries"]:
-            await status_msg.edit_text("Нічого не знайдено за запитом.\nСпробуйте змінити формулювання.")
-            return
+            await notify(job, "Нічого не знайдено за запитом.\nСпробуйте змінити формулювання.")
+            return False
 
         entry = search_result["entries"][0]
         url = entry["url"]
-        title = sanitize_filename(entry.get("title", "Unknown title"))
-        duration = entry.get("duration")
-        uploader = entry.get("uploader", "Unknown artist")
-        thumbnail = entry.get("thumbnails", [{}])[0].get("url")
-
-        await status_msg.edit_text(
-            f"🎵 <b>{title}</b>\n"
-            f"👤 {uploader}\n"
-            f"⏱ {format_duration(duration)}\n\n"
-            "Завантажую аудіо... ⏳"
-        )
 
-        # Опції для завантаження (БЕЗ FFmpeg — Railway не має ffmpeg)
-        ydl_opts_download = {
-            "format": "bestaudio/best",
-            # postprocessors повністю вимкнено — немає FFmpeg
-            "outtmpl": str(user_dir / f"{title}.%(ext)s"),
-            "quiet": True,
-            "continuedl": True,
-            "restrict_filenames": True,
-            "cookiefile": "cookies.txt",
-            "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
-            "referer": "https://www.youtube.com/",
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts_download) as ydl:
-            info = ydl.extract_info(url, download=True)
-
-        # Визначення шляху до файлу
-        if "filepath" in info and info["filepath"]:
-            filepath = Path(info["filepath"])
+    job.title = sanitize_filename(entry.get("title", "Unknown title"))
+    job.duration = entry.get("duration")
+    job.uploader = entry.get("uploader", "Unknown artist")
+    job.thumbnail = (entry.get("thumbnails") or [{}])[0].get("url")
+
+    # Одне статусне повідомлення на весь запит: після пошуку й до надсилання
+    # (якщо запит чекав у черзі — редагуємо вже надіслане підтвердження)
+    status_text = (
+        f"🎵 <b>{job.title}</b>\n"
+        f"👤 {job.uploader}\n"
+        f"⏱ {format_duration(job.duration)}\n\n"
+        "Завантажую аудіо... ⏳"
+    )
+    if job.status_msg:
+        await job.status_msg.edit_text(status_text)
+    else:
+        job.status_msg = await job.message.answer(status_text)
+
+    # Тимчасова тека в системному tmp — видаляється після надсилання
+    job.tmp_dir = tempfile.TemporaryDirectory(prefix="kotea_")
+    download_dir = Path(job.tmp_dir.name)
+    info = await run_blocking(DOWNLOAD_EXECUTOR, _run_download, url, download_dir, resolved)
+
+    # Визначення шляху до файлу
+    info = (info.get("requested_downloads") or [info])[-1]
+    if info.get("filepath"):
+        filepath = Path(info["filepath"])
+    else:
+        audio_files = list(download_dir.glob("*.*"))  # шукаємо будь-який аудіофайл
+        if audio_files:
+            filepath = audio_files[0]
+            logger.info(f"Використано fallback: знайдено {filepath}")
         else:
-            audio_files = list(user_dir.glob("*.*"))  # шукаємо будь-який аудіофайл
-            if audio_files:
-                filepath = audio_files[0]
-                logger.info(f"Використано fallback: знайдено {filepath}")
-            else:
-                await status_msg.edit_text("Не вдалося знайти завантажений аудіофайл 😢")
-                return
-
-        logger.info(f"Фінальний файл: {filepath}")
-
-        if not filepath.exists():
-            await status_msg.edit_text("Файл не створено після завантаження 😢")
-            return
-
-        file_size_mb = filepath.stat().st_size / (1024 * 1024)
-
-        if file_size_mb > MAX_FILE_SIZE_MB:
-            await status_msg.edit_text(
-                f"Файл завеликий ({file_size_mb:.1f} MB > {MAX_FILE_SIZE_MB} MB).\n"
-                "Telegram не дозволяє надсилати такі файли без Premium."
-            )
-            filepath.unlink(missing_ok=True)
-            return
-
-        await status_msg.edit_text("Надсилаю аудіо... 📤")
-
-        audio = FSInputFile(filepath)
-        caption_text = (
-            f"<b>{title}</b>\n"
-            f"Виконавець: {uploader}\n"
-            f"Тривалість: {format_duration(duration)}\n"
-            f"Запит: {query}"
-        )
-        if BOT_USERNAME:
-            caption_text += f"\n@{BOT_USERNAME}"
+            await notify(job, "Не вдалося знайти завантажений аудіофайл 😢")
+            return False
 
-        await message.answer_audio(
-            audio=audio,
-            title=title,
-            performer=uploader,
-            duration=int(duration) if duration else None,
-            thumbnail=types.URLInputFile(thumbnail) if thumbnail else None,
-            caption=caption_text
+    job.info = {**info, "filepath": str(filepath), "ext": filepath.suffix.lstrip(".")}
+    return True
+
+async def encode_and_send(job: DownloadJob):
+    if job.info["ext"] != "m4a":
+        async with ENCODE_SEMAPHORE:
+            job.info = await run_blocking(ENCODE_EXECUTOR, _run_encode, job.info)
+
+    filepath = Path(job.info["filepath"])
+    logger.info(f"Фінальний файл: {filepath}")
+
+    if not filepath.exists():
+        await notify(job, "Файл не створено після завантаження 😢")
+        return
+
+    file_size_mb = filepath.stat().st_size / (1024 * 1024)
+
+    if file_size_mb > MAX_FILE_SIZE_MB:
+        await notify(
+            job,
+            f"Файл завеликий ({file_size_mb:.1f} MB > {MAX_FILE_SIZE_MB} MB).\n"
+            "Telegram не дозволяє надсилати такі файли без Premium."
         )
+        return
 
-        await status_msg.delete()
+    audio = FSInputFile(
+        filepath,
+        filename=f"{job.title}{filepath.suffix}",
+        chunk_size=UPLOAD_CHUNK_SIZE
+    )
 
-    except Exception as e:
-        logger.exception("Критична помилка")
-        error_text = f"Сталася помилка: {str(e)[:200]}..."
+    sent = await job.message.answer_audio(
+        audio=audio,
+        title=job.title,
+        performer=job.uploader,
+        duration=int(job.duration) if job.duration else None,
+        thumbnail=types.URLInputFile(job.thumbnail) if job.thumbnail else None,
+        caption=build_caption(job.title, job.uploader, job.duration, job.query)
+    )
+    if sent.audio:
+        cache_put(job.cache_key, {
+            "file_id": sent.audio.file_id,
+            "title": job.title,
+            "uploader": job.uploader,
+            "duration": job.duration,
+        })
+
+    await job.status_msg.delete()
+
+async def downloader_worker():
+    # Мережевий етап: пошук і завантаження з YouTube
+    global downloaders_busy
+    while True:
+        job = await DOWNLOAD_Q.get()
+        downloaders_busy += 1
+        handed_over = False
         try:
-            await status_msg.edit_text(error_text)
-        except:
-            await message.answer(error_text)
+            if await fetch_track(job):
+                await UPLOAD_Q.put(job)
+                handed_over = True
+        except Exception as e:
+            await report_error(job, e)
+        finally:
+            if not handed_over and job.tmp_dir:
+                job.tmp_dir.cleanup()
+            downloaders_busy -= 1
+            DOWNLOAD_Q.task_done()
+
+async def upload_worker():
+    # Перекодування, якщо потрібне (під ENCODE_SEMAPHORE), і надсилання в Telegram
+    while True:
+        job = await UPLOAD_Q.get()
+        try:
+            await encode_and_send(job)
+        except Exception as e:
+            await report_error(job, e)
+        finally:
+            job.tmp_dir.cleanup()
+            UPLOAD_Q.task_done()
+
+def start_workers():
+    for _ in range(DOWNLOAD_WORKERS):
+        worker_tasks.append(asyncio.create_task(downloader_worker()))
+    for _ in range(UPLOAD_WORKERS):
+        worker_tasks.append(asyncio.create_task(upload_worker()))
 
-    finally:
-        clean_user_dir(user_dir)
-        if state:
-            await state.clear()
+async def download_and_send(
+    message: Message,
+    query: str,
+    state: FSMContext = None
+):
+    if state:
+        await state.clear()
+
+    video_id = extract_video_id(query)
+    cache_key = f"yt:{video_id}" if video_id else normalize_query(query)
+    if await send_cached(message, query, cache_key):
+        return
+    # Схоже на ID, але могло бути закешоване як текстовий запит (див. fetch_track)
+    if YT_ID_RE.match(query) and await send_cached(message, query, normalize_query(query)):
+        return
+
+    # Вільного воркера не лишилося (зайняті + вже чекають у черзі) — одразу відповідаємо,
+    # щоб запит не чекав у тиші. Це повідомлення потім стане статусним
+    status_msg = None
+    if downloaders_busy + DOWNLOAD_Q.qsize() >= DOWNLOAD_WORKERS:
+        status_msg = await message.answer("🔍 Шукаю... (запит у черзі)")
+
+    await DOWNLOAD_Q.put(DownloadJob(
+        message=message,
+        query=query,
+        cache_key=cache_key,
+        video_id=video_id,
+        status_msg=status_msg,
+    ))
 
 # ────────────────────────────────────────────────
 # Хендлери
@@ -246,6 +591,7 @@ async def cmd_start(message: Message):
         "• dua lipa houdini\n"
         "• the weeknd blinding lights\n"
         "• кравець пам’ятаєш\n\n"
+        "Або надішли посилання на відео YouTube.\n\n"
         "<i>Працюю через YouTube → аудіо (Railway)</i>"
     )
 
@@ -255,8 +601,11 @@ async def cmd_search(message: Message, state: FSMContext):
     await state.set_state(SearchForm.waiting_for_query)
 
 @router.message(F.text.startswith(("http://", "https://")))
-async def handle_possible_link(message: Message):
-    await message.answer("Я зараз приймаю тільки текстовий запит (назва + виконавець).\nНадішли, наприклад: «the weeknd blinding lights»")
+async def handle_possible_link(message: Message, state: FSMContext):
+    if extract_video_id(message.text):
+        await download_and_send(message, message.text.strip(), state)
+        return
+    await message.answer("Я приймаю текстовий запит (назва + виконавець) або посилання на YouTube.\nНадішли, наприклад: «the weeknd blinding lights»")
 
 @router.message()
 async def handle_text_query(message: Message, state: FSMContext):
@@ -267,19 +616,53 @@ async def handle_text_query(message: Message, state: FSMContext):
     if len(query) > REQUEST_MAX_LENGTH:
         await message.answer("Запит занадто довгий. Спробуй коротше.")
         return
-    if re.search(r"https?://", query):
-        await message.answer("Я зараз працюю тільки з текстовими запитами.\nНадішли назву пісні / виконавця.")
-        return
     await download_and_send(message, query, state)
 
 # ────────────────────────────────────────────────
 # Запуск
 # ────────────────────────────────────────────────
 
+def _run_prewarm():
+    # Створює екземпляри YoutubeDL поточного потоку й завантажує класи екстракторів.
+    # Записи ytsearch генеруються ліниво, тож з process=False запиту до YouTube немає
+    _get_ydl("download")
+    with _using_ydl("search") as ydl:
+        ydl.extract_info("ytsearch1:test", download=False, process=False)
+
+async def prewarm_ytdlp():
+    # Пул запускає новий потік на кожне завдання, поки вільних немає, тож
+    # одночасні виклики на старті прогрівають усі потоки DOWNLOAD_EXECUTOR
+    try:
+        await asyncio.gather(*(
+            run_blocking(DOWNLOAD_EXECUTOR, _run_prewarm)
+            for _ in range(DOWNLOAD_WORKERS)
+        ))
+        logger.info("yt-dlp прогріто")
+    except Exception as e:
+        logger.warning(f"Не вдалося прогріти yt-dlp: {e}")
+
+async def prewarm_redis():
+    if not isinstance(storage, RedisStorage):
+        return
+    try:
+        await storage.redis.ping()
+        logger.info("Redis підключено")
+    except Exception as e:
+        logger.warning(f"Redis недоступний: {e}")
+
 async def main():
     logger.info("Бот запускається на Railway...")
-    await load_bot_username()
-    await dp.start_polling(bot)
+    start_workers()
+    # Прогрів іде паралельно з polling і не затримує його;
+    # username бота отримується в startup-хуку (load_bot_username)
+    await asyncio.gather(
+        prewarm_ytdlp(),
+        prewarm_redis(),
+        dp.start_polling(bot),
+    )
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())